@@ -6,18 +6,24 @@
 # (at your option) any later version.
 
 from dataclasses import dataclass
-from typing import List, Optional, Tuple
+from typing import Optional, Sequence, Tuple
 
 import math3d
-from vtkmodules.vtkCommonCore import vtkPoints, vtkLookupTable, vtkIntArray
+import numpy as np
+from vtkmodules.util.numpy_support import numpy_to_vtk, numpy_to_vtkIdTypeArray
+from vtkmodules.vtkCommonCore import VTK_FLOAT, VTK_INT, VTK_UNSIGNED_CHAR, vtkPoints, vtkLookupTable
 from vtkmodules.vtkCommonDataModel import vtkPolyData, vtkCellArray
 from vtkmodules.vtkRenderingCore import vtkProperty
 
 from segmentation.style import Styles
+from segmentation.transform import apply_transform
 
 
 @dataclass(slots=True, frozen=True)
 class Triangle:
+    """
+    The i,j,k indices of a single row of @:type TriangleMesh triangles
+    """
     i: int
     j: int
     k: int
@@ -25,17 +31,19 @@ class Triangle:
 
 class TriangleMesh:
     """
-    A triangle mesh that can be built from a list of vec3 and i,j,k tuples that define
-    connectivity into the former vec3 list. Converts this mesh to a polydata that can be
-    rendered by a vtk renderer. Aggregates styles and manages them via a lookup table or
-    a single property if there is a 1:1 relationship between itself and a style
+    A triangle mesh that can be built from a flat list of x,y,z coordinates and i,j,k indices that
+    define connectivity into the former. Both are held as (N, 3) numpy arrays. Converts this mesh to
+    a polydata that can be rendered by a vtk renderer. Aggregates styles and manages them via a lookup
+    table or a single property if there is a 1:1 relationship between itself and a style
     """
+    __slots__ = ('_vertices', '_triangles', '_transform', '_polydata', '_topology', '_styles', '_type')
 
     def __init__(self, category: str):
-        self._vertices: List[math3d.Vector3] = []
-        self._triangles: List[Triangle] = []
+        self._vertices: np.ndarray = np.empty((0, 3), dtype=np.float32)
+        self._triangles: np.ndarray = np.empty((0, 3), dtype=np.int32)
         self._transform: Optional[math3d.Matrix4] = None
         self._polydata: Optional[vtkPolyData] = None
+        self._topology: Optional[vtkPolyData] = None
         self._styles: Optional[Styles] = None
         self._type = category
 
@@ -52,22 +60,29 @@ class TriangleMesh:
         return self._type
 
     @property
-    def vertices(self) -> List[math3d.Vector3]:
+    def vertices(self) -> np.ndarray:
         return self._vertices
 
     @vertices.setter
-    def vertices(self, points: List[float]):
-        for i in range(0, len(points), 3):
-            self._vertices.append(math3d.Vector3(points[i], points[i + 1], points[i + 2]))
+    def vertices(self, points: Sequence[float] | np.ndarray):
+        self._vertices = np.asarray(points, dtype=np.float32).reshape(-1, 3)
+        self._polydata = None
+
+    def vertex(self, index: int) -> math3d.Vector3:
+        return math3d.Vector3(*self._vertices[index].tolist())
 
     @property
-    def triangles(self) -> List[Triangle]:
+    def triangles(self) -> np.ndarray:
         return self._triangles
 
     @triangles.setter
-    def triangles(self, tris: List[int]):
-        for i in range(0, len(tris), 3):
-            self._triangles.append(Triangle(tris[i], tris[i + 1], tris[i + 2]))
+    def triangles(self, tris: Sequence[int] | np.ndarray):
+        self._triangles = np.asarray(tris, dtype=np.int32).reshape(-1, 3)
+        self._polydata = None
+        self._topology = None
+
+    def triangle(self, index: int) -> Triangle:
+        return Triangle(*self._triangles[index].tolist())
 
     @property
     def transform(self) -> Optional[math3d.Matrix4]:
@@ -77,10 +92,12 @@ class TriangleMesh:
     def transform(self, matrix):
         self._transform = \
             math3d.Matrix4([matrix[i:i + 4] for i in range(0, len(matrix), 4)], math3d.col_major)
+        self._polydata = None
 
     @property
     def polydata(self) -> Optional[vtkPolyData]:
-        if not self._polydata:
+        # Setters drop the cached polydata, so it is built once and reused until the mesh changes
+        if self._polydata is None:
             self._polydata = self._build_polydata()
         return self._polydata
 
@@ -91,57 +108,73 @@ class TriangleMesh:
     @styles.setter
     def styles(self, styles: Styles):
         self._styles = styles
+        self._polydata = None
+        self._topology = None
+
+    def instance(self, category: str) -> 'TriangleMesh':
+        """
+        Creates a mesh that shares this mesh's vertices, triangles, styles and vtk cells. Only the
+        instance's own transform is applied when its polydata is built
+        """
+        trimesh = TriangleMesh(category)
+        trimesh._vertices = self._vertices
+        trimesh._triangles = self._triangles
+        trimesh._styles = self._styles
+        trimesh._topology = self._get_topology()
+        return trimesh
 
     def get_lut_and_prop(self) -> Tuple[vtkLookupTable | None, vtkProperty]:
         # NOTE
         # 1. Set the prop opacity to 1 so the opacity from lut is used
         # 2. Use the first style's specular when there are multiple styles involved to keep this app simple
+        # 3. A style's property is shared by every mesh with that style, so it is copied before it is changed
         styles = self.styles.list
         num_styles = len(styles)
         prop: vtkProperty = styles[0].style
         if num_styles > 1:
+            prop = vtkProperty()
+            prop.DeepCopy(styles[0].style)
+            rgba = np.array([(style.diffuse.r, style.diffuse.g, style.diffuse.b, style.alpha) for style in styles])
             lut = vtkLookupTable()
-            lut.SetNumberOfTableValues(num_styles)
-            for i in range(0, num_styles):
-                lut.SetTableValue(i, styles[i].diffuse.r, styles[i].diffuse.g, styles[i].diffuse.b, styles[i].alpha)
+            lut.SetTable(numpy_to_vtk(np.rint(rgba * 255).astype(np.uint8), deep=1, array_type=VTK_UNSIGNED_CHAR))
             prop.SetOpacity(1)
             return lut, prop
         else:
             return None, prop
 
     def _build_polydata(self) -> Optional[vtkPolyData]:
-        if not self._vertices or not self._triangles:
+        if not len(self._vertices) or not len(self._triangles):
             return None
 
+        # Arrays built here are owned by nothing else, so vtk keeps a reference to them instead of a copy
         points = vtkPoints()
-        points.SetNumberOfPoints(len(self._vertices))
-        for i in range(0, len(self._vertices)):
-            point = self._transform * math3d.Vector4(self._vertices[i])
-            points.SetPoint(i, point.x, point.y, point.z)
-
-        cell_array = vtkCellArray()
-        cell_array.AllocateEstimate(len(self._triangles), 3)
-        for tri in self._triangles:
-            cell_array.InsertNextCell(3)
-            cell_array.InsertCellPoint(tri.i)
-            cell_array.InsertCellPoint(tri.j)
-            cell_array.InsertCellPoint(tri.k)
-
-        style_cell_ids = vtkIntArray()
-        style_cell_ids.SetName('Style Id')
-        style_cell_ids.SetNumberOfComponents(1)
-        style_cell_ids.SetNumberOfTuples(len(self._triangles))
-
-        styles = self._styles.list
-        for i in range(0, len(styles)):
-            face_ids = self._styles.get_faces(styles[i])
-            for face_id_range in face_ids:
-                for face_id in range(face_id_range[0], face_id_range[1] + 1):
-                    style_cell_ids.SetTuple1(face_id, i)
+        points.SetData(numpy_to_vtk(apply_transform(self._transform, self._vertices), deep=0, array_type=VTK_FLOAT))
 
+        topology = self._get_topology()
         poly_data = vtkPolyData()
         poly_data.SetPoints(points)
-        poly_data.SetPolys(cell_array)
-        poly_data.GetCellData().SetScalars(style_cell_ids)
+        poly_data.SetPolys(topology.GetPolys())
+        poly_data.GetCellData().SetScalars(topology.GetCellData().GetScalars())
 
         return poly_data
+
+    def _get_topology(self) -> vtkPolyData:
+        if self._topology is None:
+            self._topology = self._build_topology()
+        return self._topology
+
+    def _build_topology(self) -> vtkPolyData:
+        # Cells and style ids don't depend on the transform, so instances of the same geometry share them
+        offsets = np.arange(0, 3 * len(self._triangles) + 1, 3, dtype=np.int64)
+        connectivity = self._triangles.reshape(-1).astype(np.int64)
+        cell_array = vtkCellArray()
+        cell_array.SetData(numpy_to_vtkIdTypeArray(offsets, deep=0), numpy_to_vtkIdTypeArray(connectivity, deep=0))
+
+        style_cell_ids = numpy_to_vtk(self._styles.as_cell_scalars(len(self._triangles)), deep=0, array_type=VTK_INT)
+        style_cell_ids.SetName('Style Id')
+
+        topology = vtkPolyData()
+        topology.SetPolys(cell_array)
+        topology.GetCellData().SetScalars(style_cell_ids)
+
+        return topology
@@ -10,8 +10,10 @@ from __future__ import annotations
 import argparse
 from typing import List, Tuple
 
-from math3d import AABB, Extent, Vector3, Vector4
-from vtkmodules.vtkCommonCore import vtkPoints
+import numpy as np
+from math3d import AABB, Extent, Vector3
+from vtkmodules.util.numpy_support import numpy_to_vtk, numpy_to_vtkIdTypeArray
+from vtkmodules.vtkCommonCore import VTK_FLOAT, vtkPoints
 from vtkmodules.vtkCommonDataModel import vtkPolyData, vtkCellArray
 from vtkmodules.vtkFiltersCore import vtkAppendPolyData
 from vtkmodules.vtkFiltersSources import vtkSphereSource, vtkConeSource
@@ -19,92 +21,111 @@ from vtkmodules.vtkFiltersSources import vtkSphereSource, vtkConeSource
 from segmentation.mesh import TriangleMesh
 from segmentation.reader import E57Reader, IFCReader
 from segmentation.renderer import Renderer, MeshRep
+from segmentation.transform import apply_transform
 
 _MAX_DEFAULT_OCTREE_LEVELS: int = 3
 _NUM_PTS_IN_OCTANT_FACE_LOOP: int = 5
 
+# Corners of the unit box and its closed face loops, in math3d's corner and face order
+_UNIT_BOX_CORNERS: np.ndarray = \
+    np.array([(c.x, c.y, c.z) for c in AABB(Vector3(0, 0, 0), Vector3(1, 1, 1)).corners], dtype=np.float64)
+_BOX_FACE_LOOPS: np.ndarray = np.array([[*face, face[0]] for face in AABB().edges], dtype=np.int64)
+# Directions from an octant's center to the outer corners of its eight children
+_OCTANT_DIRECTIONS: np.ndarray = \
+    np.array([(x, y, z) for x in (-1, +1) for y in (-1, +1) for z in (-1, +1)], dtype=np.float64)
+
+
+def _as_array(vector: Vector3) -> np.ndarray:
+    return np.array([vector.x, vector.y, vector.z], dtype=np.float64)
+
+
+def _grid(min_corner: np.ndarray, max_corner: np.ndarray, subdivisions: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Splits a box into subdivisions^3 equal cells and returns their min and max corners as (N, 3) arrays
+    """
+    axes: List[np.ndarray] = [np.linspace(min_corner[i], max_corner[i], subdivisions + 1) for i in range(3)]
+    mins = np.stack(np.meshgrid(*(axis[:-1] for axis in axes), indexing='ij'), axis=-1).reshape(-1, 3)
+    maxs = np.stack(np.meshgrid(*(axis[1:] for axis in axes), indexing='ij'), axis=-1).reshape(-1, 3)
+    return mins, maxs
+
+
+def _boxes_polydata(mins: np.ndarray, maxs: np.ndarray) -> vtkPolyData:
+    """
+    Builds a single polydata with the face loops of all boxes given by (N, 3) min and max corners
+    """
+    num_boxes: int = len(mins)
+    corners: np.ndarray = mins[:, np.newaxis, :] + _UNIT_BOX_CORNERS * (maxs - mins)[:, np.newaxis, :]
+    points: vtkPoints = vtkPoints()
+    points.SetData(numpy_to_vtk(corners.reshape(-1, 3).astype(np.float32), deep=0, array_type=VTK_FLOAT))
+    connectivity: np.ndarray = \
+        (_BOX_FACE_LOOPS + len(_UNIT_BOX_CORNERS) * np.arange(num_boxes, dtype=np.int64)[:, np.newaxis, np.newaxis])
+    offsets: np.ndarray = np.arange(0, connectivity.size + 1, _NUM_PTS_IN_OCTANT_FACE_LOOP, dtype=np.int64)
+    cells: vtkCellArray = vtkCellArray()
+    cells.SetData(numpy_to_vtkIdTypeArray(offsets, deep=0), numpy_to_vtkIdTypeArray(connectivity.reshape(-1), deep=0))
+    polydata: vtkPolyData = vtkPolyData()
+    polydata.SetPoints(points)
+    polydata.SetLines(cells)
+    return polydata
+
 
 class Octant:
+    """
+    An octree cell given by its min and max corners. Cells below it are not stored, they are
+    computed from its corners when requested
+    """
+    __slots__ = ('_min', '_max', '_level')
     _MAX_LEVELS: int = _MAX_DEFAULT_OCTREE_LEVELS
 
-    def __init__(self, min_corner: Vector3, max_corner: Vector3, parent: Octant | None = None):
-        self._parent = parent
-        self._center = (min_corner + max_corner) * 0.5
-        self._length = (max_corner.x - min_corner.x, max_corner.y - min_corner.y, max_corner.z - min_corner.z)
-        self._level = 1 if parent is None else parent.level + 1
-        self._children: List[Octant] = []
-        self._bounds: AABB = AABB(Extent(min_corner.x, max_corner.x),
-                                  Extent(min_corner.y, max_corner.y),
-                                  Extent(min_corner.z, max_corner.z))
-        self._subdivide()
+    def __init__(self, min_corner: np.ndarray, max_corner: np.ndarray, level: int = 1):
+        self._min = np.asarray(min_corner, dtype=np.float64)
+        self._max = np.asarray(max_corner, dtype=np.float64)
+        self._level = level
 
     @property
     def length(self) -> Tuple[float, float, float]:
-        return self._length
+        return tuple((self._max - self._min).tolist())
 
     @property
     def center(self) -> Vector3:
-        return self._center
+        return Vector3(*((self._min + self._max) * 0.5).tolist())
 
     @property
     def level(self) -> int:
         return self._level
 
     @property
-    def children(self) -> List[Octant]:
-        return self._children
+    def bounds(self) -> AABB:
+        return AABB(Vector3(*self._min.tolist()), Vector3(*self._max.tolist()))
 
-    def _subdivide(self):
+    @property
+    def children(self) -> List[Octant]:
         if self.level == Octant._MAX_LEVELS:
-            self._children = []
-            return
-
-        half_lengths = tuple(self.length[i] * 0.5 for i in range(3))
-        dir_vectors: List[Vector3] = [Vector3(half_lengths[0] * x, half_lengths[1] * y, half_lengths[2] * z)
-                                      for x in (-1, +1)
-                                      for y in (-1, +1)
-                                      for z in (-1, +1)]
-        self._children.clear()
-        for dir_vector in dir_vectors:
-            corner: Vector3 = self.center + dir_vector
-            min_corner: Vector3 = Vector3(min(corner.x, self.center.x), min(corner.y, self.center.y),
-                                          min(corner.z, self.center.z))
-            max_corner: Vector3 = Vector3(max(corner.x, self.center.x), max(corner.y, self.center.y),
-                                          max(corner.z, self.center.z))
-            self._children.append(Octant(min_corner, max_corner, self))
+            return []
+        center: np.ndarray = (self._min + self._max) * 0.5
+        corners: np.ndarray = center + _OCTANT_DIRECTIONS * ((self._max - self._min) * 0.5)
+        mins: np.ndarray = np.minimum(corners, center)
+        maxs: np.ndarray = np.maximum(corners, center)
+        return [Octant(mins[i], maxs[i], self.level + 1) for i in range(len(mins))]
 
-    def leaves(self, leaves: List[Octant]):
-        if not self._children:
-            leaves.append(self)
-            return
+    def leaf_bounds(self) -> Tuple[np.ndarray, np.ndarray]:
+        return _grid(self._min, self._max, 2 ** (Octant._MAX_LEVELS - self.level))
 
-        for child in self._children:
-            child.leaves(leaves)
+    def leaves(self, leaves: List[Octant]):
+        mins, maxs = self.leaf_bounds()
+        leaves.extend(Octant(mins[i], maxs[i], Octant._MAX_LEVELS) for i in range(len(mins)))
 
     @property
     def polydata(self) -> vtkPolyData | None:
         if self.level == Octant._MAX_LEVELS:
-            polydata: vtkPolyData = vtkPolyData()
-            points: vtkPoints = vtkPoints()
-            corners: List[Vector3] = self._bounds.corners
-            points.SetNumberOfPoints(len(corners))
-            for i in range(len(corners)):
-                points.SetPoint(i, corners[i].x, corners[i].y, corners[i].z)
-            edges: List[List[int]] = self._bounds.edges
-            cells: vtkCellArray = vtkCellArray()
-            cells.AllocateEstimate(len(edges), _NUM_PTS_IN_OCTANT_FACE_LOOP)
-            for a, b, c, d in edges:
-                cells.InsertNextCell(_NUM_PTS_IN_OCTANT_FACE_LOOP, [a, b, c, d, a])
-            polydata.SetPoints(points)
-            polydata.SetLines(cells)
-            return polydata
+            return _boxes_polydata(self._min[np.newaxis], self._max[np.newaxis])
         return None
 
 
 class Octree:
 
     def __init__(self, bounds: AABB = None):
-        self._octant: Octant | None = Octant(bounds.min, bounds.max) if bounds else None
+        self._octant: Octant | None = Octant(_as_array(bounds.min), _as_array(bounds.max)) if bounds else None
+        self._polydata: vtkPolyData | None = None
 
     @classmethod
     def from_polydata(cls, polydata: vtkPolyData):
@@ -116,19 +137,16 @@ class Octree:
         return Octree(bounds)
 
     def add(self, trimeshes: List[TriangleMesh]):
-        bounds: AABB = AABB()
-        x: Extent = Extent()
-        y: Extent = Extent()
-        z: Extent = Extent()
+        min_corner: np.ndarray = np.full(3, np.inf)
+        max_corner: np.ndarray = np.full(3, -np.inf)
         for trimesh in trimeshes:
-            for vertex in trimesh.vertices:
-                transformed_vertex = trimesh.transform * Vector4(vertex)
-                x.update(transformed_vertex.x)
-                y.update(transformed_vertex.y)
-                z.update(transformed_vertex.z)
-            trimesh_bounds: AABB = AABB(x, y, z)
-            bounds.merge(trimesh_bounds)
-        self._octant = Octant(bounds.min, bounds.max)
+            if not len(trimesh.vertices):
+                continue
+            points: np.ndarray = apply_transform(trimesh.transform, trimesh.vertices)
+            min_corner = np.minimum(min_corner, points.min(axis=0))
+            max_corner = np.maximum(max_corner, points.max(axis=0))
+        self._octant = Octant(min_corner, max_corner)
+        self._polydata = None
 
     @property
     def leaves(self) -> List[Octant]:
@@ -137,13 +155,11 @@ class Octree:
         return leaves
 
     @property
-    def polydata(self):
-        leaves: List[Octant] = self.leaves
-        append_polydata: vtkAppendPolyData = vtkAppendPolyData()
-        for leaf in leaves:
-            append_polydata.AddInputData(leaf.polydata)
-        append_polydata.Update()
-        return append_polydata.GetOutput()
+    def polydata(self) -> vtkPolyData:
+        if self._polydata is None:
+            mins, maxs = self._octant.leaf_bounds()
+            self._polydata = _boxes_polydata(mins, maxs)
+        return self._polydata
 
 
 if __name__ == "__main__":
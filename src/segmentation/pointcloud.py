@@ -4,25 +4,30 @@
 # it under the terms of the GNU General Public License as published by
 # the Free Software Foundation, either version 3 of the License, or
 # (at your option) any later version.
-from typing import List
+from typing import Tuple
 
 import numpy as np
 import pye57
 import vtk
-from math3d import Vector3, Vector4, Matrix4, Identity4, AABB, Extent
+from vtk.util.numpy_support import numpy_to_vtk, numpy_to_vtkIdTypeArray
+from math3d import Vector3, Matrix4, Identity4, AABB
 
-from segmentation.style import Color
+from segmentation.transform import apply_transform
+
+_COORDINATE_FIELDS: Tuple[str, ...] = ('cartesianX', 'cartesianY', 'cartesianZ')
+_COLOR_FIELDS: Tuple[str, ...] = ('colorRed', 'colorGreen', 'colorBlue')
 
 
 class PointCloud:
     """
     Reads an e57 with pye57 and converts it to a vtk polydata composed of 0D vertices
     """
+    __slots__ = ('_e57', '_coords', '_colors', '_polydata', '_transform')
 
     def __init__(self, e57: pye57.E57):
         self._e57 = e57
-        self._coords: List[Vector3] = []
-        self._colors: List[Color] = []
+        self._coords: np.ndarray | None = None
+        self._colors: np.ndarray | None = None
         self._polydata = None
         self._transform: Matrix4 = Identity4()
 
@@ -35,26 +40,21 @@ class PointCloud:
         self._transform = transform
 
     @property
-    def points(self) -> List[Vector3]:
-        if not self._coords:
+    def points(self) -> np.ndarray:
+        if self._coords is None:
             self._read()
         return self._coords
 
     @property
     def bounds(self) -> AABB:
-        points: List[Vector3] = self.points
-        x: Extent = Extent()
-        y: Extent = Extent()
-        z: Extent = Extent()
-        for point in points:
-            x.update(point.x)
-            y.update(point.y)
-            z.update(point.z)
-        return AABB(x, y, z)
+        points: np.ndarray = self.points
+        if not len(points):
+            return AABB()
+        return AABB(Vector3(*points.min(axis=0).tolist()), Vector3(*points.max(axis=0).tolist()))
 
     @property
-    def colors(self) -> List[Color]:
-        if not self._colors:
+    def colors(self) -> np.ndarray | None:
+        if self._coords is None:
             self._read()
         return self._colors
 
@@ -65,43 +65,44 @@ class PointCloud:
         return self._polydata
 
     def _read(self):
-        if not self._colors or not self._coords:
-            num_scans: int = self._e57.scan_count
-            for i in range(num_scans):
-                e57_data = self._e57.read_scan(i, colors=True, ignore_missing_fields=True)
-                x: np.ndarray = e57_data['cartesianX']
-                y: np.ndarray = e57_data['cartesianY']
-                z: np.ndarray = e57_data['cartesianZ']
-                for px, py, pz in zip(x, y, z, strict=True):
-                    self._coords.append(Vector3(px, py, pz))
-                if 'colorRed' in e57_data:
-                    r: np.ndarray = e57_data['colorRed']
-                    g: np.ndarray = e57_data['colorGreen']
-                    b: np.ndarray = e57_data['colorBlue']
-                    for pr, pg, pb in zip(r, g, b, strict=True):
-                        self._colors.append(Color(pr / 255, pg / 255, pb / 255))
+        # Scans are written into buffers sized from the scan headers, which count the invalid points too
+        num_scans: int = self._e57.scan_count
+        num_points: int = sum(self._e57.get_header(i).point_count for i in range(num_scans))
+        coords: np.ndarray = np.empty((num_points, 3), dtype=np.float32)
+        colors: np.ndarray | None = np.empty((num_points, 3), dtype=np.uint8)
+        offset: int = 0
+        for i in range(num_scans):
+            e57_data = self._e57.read_scan(i, colors=True, ignore_missing_fields=True)
+            scan_size: int = len(e57_data['cartesianX'])
+            # Columns are cast straight into the buffers, without stacking a temporary (N, 3) array per scan
+            for column, field in enumerate(_COORDINATE_FIELDS):
+                coords[offset:offset + scan_size, column] = e57_data[field]
+            # Colors are only usable if every scan has them
+            if colors is not None and _COLOR_FIELDS[0] in e57_data:
+                for column, field in enumerate(_COLOR_FIELDS):
+                    colors[offset:offset + scan_size, column] = e57_data[field]
+            else:
+                colors = None
+            offset += scan_size
+        if offset < num_points:
+            coords = coords[:offset].copy()
+            colors = colors[:offset].copy() if colors is not None else None
+        self._coords = coords
+        self._colors = colors
 
     def _assemble(self) -> None:
-        if not self._coords:
+        if self._coords is None:
             self._read()
         self._polydata = vtk.vtkPolyData()
         points = vtk.vtkPoints()
+        # Transformed points, cells and colors are not copied again, the vtk arrays keep a reference to them
+        points.SetData(numpy_to_vtk(apply_transform(self._transform, self._coords), deep=0, array_type=vtk.VTK_FLOAT))
         cells = vtk.vtkCellArray()
-        points.SetNumberOfPoints(len(self._coords))
-        cells.AllocateEstimate(len(self._coords), 1)
-        colors = vtk.vtkFloatArray() if self._colors else None
-        if colors:
-            colors.SetName('rgb')
-            colors.SetNumberOfComponents(3)
-            colors.SetNumberOfTuples(len(self._colors))
-        for idx, coord in enumerate(self._coords):
-            transformed_point: Vector4 = self._transform * Vector4(coord)
-            points.SetPoint(idx, transformed_point.x, transformed_point.y, transformed_point.z)
-            cells.InsertNextCell(1)
-            cells.InsertCellPoint(idx)
-            if colors:
-                colors.SetTuple3(idx, self._colors[idx].r, self._colors[idx].g, self._colors[idx].b)
+        cells.SetData(numpy_to_vtkIdTypeArray(np.arange(len(self._coords) + 1, dtype=np.int64), deep=0),
+                      numpy_to_vtkIdTypeArray(np.arange(len(self._coords), dtype=np.int64), deep=0))
         self._polydata.SetPoints(points)
         self._polydata.SetVerts(cells)
-        if colors:
+        if self._colors is not None:
+            colors = numpy_to_vtk(self._colors, deep=0, array_type=vtk.VTK_UNSIGNED_CHAR)
+            colors.SetName('rgb')
             self._polydata.GetPointData().SetScalars(colors)
@@ -8,18 +8,30 @@
 import multiprocessing
 import os.path
 import sys
-from typing import Optional, List, Dict, Tuple
+from typing import Optional, List, Dict, Tuple, Iterator
 
 import ifcopenshell as ifc
 import ifcopenshell.geom
+import numpy as np
 import pye57
-from math3d import Vector3
-from rich import print
 
-from segmentation.mesh import TriangleMesh, Triangle
+from segmentation.mesh import TriangleMesh
 from segmentation.pointcloud import PointCloud
 from segmentation.renderer import Renderer, MeshRep
-from segmentation.style import Style, Color, Styles
+from segmentation.style import Style, Color, Styles, rle_groups
+
+
+def _raw_buffer(geometry: ifc.ifcopenshell_wrapper.Triangulation, name: str, dtype: type) -> bytes:
+    """
+    Returns the bytes of a geometry's vertex or face array. Uses ifcopenshell's *_buffer accessor
+    when the installed version has one and otherwise packs the values without boxing each one
+    into a list first
+    """
+    buffer = getattr(geometry, f'{name}_buffer', None)
+    if buffer is not None:
+        return buffer
+    values = getattr(geometry, name)
+    return np.fromiter(values, dtype=dtype, count=len(values)).tobytes()
 
 
 class IFCReader:
@@ -56,61 +68,92 @@ class IFCReader:
         return self._meshes
 
     def summary(self, detailed: bool = False) -> None:
+        from rich import print
         print(f'File name: [yellow]{self.file}[/yellow]')
         print(f'Schema: [bold yellow]{self.model.schema_identifier}[bold yellow]')
         print(f'Number of meshes: {len(self.meshes)}')
         if detailed:
-            for m in self._meshes:
-                print(f'{m}')
+            # The mesh descriptions carry no markup, so they skip rich and are written out in one call
+            sys.stdout.write(''.join(f'{m}\n' for m in self._meshes))
+
+    def iter_meshes(self) -> Iterator[TriangleMesh]:
+        """
+        Yields the meshes in file order, each one as soon as it is converted, while the rest of the
+        file is still being read. Once the whole file has been read, the meshes are kept and later
+        calls yield them without reading the file again
+        """
+        if self._meshes:
+            yield from self._meshes
+            return
+        meshes: List[TriangleMesh] = []
+        for trimesh in self._read_meshes():
+            meshes.append(trimesh)
+            yield trimesh
+        self._meshes = meshes
 
     def _read(self) -> None:
+        for _ in self.iter_meshes():
+            pass
+
+    def _read_meshes(self) -> Iterator[TriangleMesh]:
         self._model = ifc.open(self._ifc_file)
 
         settings = ifc.geom.settings()
         iterator = ifc.geom.iterator(settings, self._model,
                                      multiprocessing.cpu_count())
 
+        # Shapes placed from the same representation share a geometry id and are converted only once
+        trimesh_by_geometry: Dict[str, TriangleMesh] = {}
         if iterator.initialize():
             while True:
                 shape = iterator.get()
-                if shape.type not in IFCReader.IGNORED_ENTITIES:
-                    self._meshes.append(IFCReader._make_trimesh(shape))
+                # Categories are interned so that filtering and grouping by them compares pointers
+                category: str = sys.intern(shape.type)
+                if category not in IFCReader.IGNORED_ENTITIES:
+                    geometry_id: str = shape.geometry.id
+                    template: Optional[TriangleMesh] = trimesh_by_geometry.get(geometry_id)
+                    if template is None:
+                        template = IFCReader._make_trimesh(category, shape.geometry)
+                        trimesh_by_geometry[geometry_id] = template
+                    yield IFCReader._place(template, category, shape.transformation.matrix)
                 if not iterator.next():
                     break
 
     @staticmethod
-    def _make_trimesh(shape: ifc.ifcopenshell_wrapper.TriangulationElement):
-        trimesh = TriangleMesh(shape.type)
-        vertices = shape.geometry.verts
-        faces = shape.geometry.faces
-        for i in range(0, len(vertices), 3):
-            trimesh.vertices.append(Vector3(vertices[i], vertices[i + 1], vertices[i + 2]))
-        for i in range(0, len(faces), 3):
-            trimesh.triangles.append(Triangle(faces[i], faces[i + 1], faces[i + 2]))
-        IFCReader._style_mesh(trimesh, shape.geometry.materials, shape.geometry.material_ids)
-        trimesh.transform = shape.transformation.matrix
+    def _place(template: TriangleMesh, category: str, matrix: Tuple[float, ...]) -> TriangleMesh:
+        # Every placement is an instance of the converted mesh with its own category and transform
+        trimesh: TriangleMesh = template.instance(category)
+        trimesh.transform = matrix
+        return trimesh
+
+    @staticmethod
+    def _make_trimesh(category: str, geometry: ifc.ifcopenshell_wrapper.Triangulation) -> TriangleMesh:
+        trimesh = TriangleMesh(category)
+        # The raw buffers are viewed as (N, 3) rows, the only copy made is the cast of the vertices to float32
+        verts: bytes = _raw_buffer(geometry, 'verts', np.float64)
+        faces: bytes = _raw_buffer(geometry, 'faces', np.int32)
+        trimesh.vertices = np.frombuffer(verts, dtype=np.float64).astype(np.float32).reshape(-1, 3)
+        trimesh.triangles = np.frombuffer(faces, dtype=np.int32).reshape(-1, 3)
+        IFCReader._style_mesh(trimesh, IFCReader._process_styles(geometry.materials), geometry.material_ids)
         return trimesh
 
     @staticmethod
-    def _style_mesh(trimesh: TriangleMesh, ifc_styles: Tuple[ifc.ifcopenshell_wrapper.style, ...],
+    def _style_mesh(trimesh: TriangleMesh, styles_dict: Dict[int, Style],
                     ifc_style_by_face_id: Tuple[int, ...]) -> None:
-        styles_dict = IFCReader._process_styles(ifc_styles)
-        mesh_styles: Styles = Styles()
-        for face_id, style_id in enumerate(ifc_style_by_face_id):
-            mesh_styles.assign(styles_dict[style_id], face_id)
+        # Each run of faces with the same material is assigned as one range, in face order
+        style_ids, starts, ends = rle_groups(np.asarray(ifc_style_by_face_id, dtype=np.int64))
+        mesh_styles: Styles = Styles(len(ifc_style_by_face_id))
+        for style_id, start, end in zip(style_ids.tolist(), starts.tolist(), ends.tolist()):
+            mesh_styles.assign_range(styles_dict[style_id], start, end)
         trimesh.styles = mesh_styles
 
     @staticmethod
     def _process_styles(ifc_styles: Tuple[ifc.ifcopenshell_wrapper.style, ...]) -> Dict[
         int, Style]:
-        styles: Dict[int, Style] = {}
-        for index in range(len(ifc_styles)):
-            ifc_style = ifc_styles[index]
-            diffuse = Color(ifc_style.diffuse.r(), ifc_style.diffuse.g(), ifc_style.diffuse.b())
-            specular = Color(ifc_style.specular.r(), ifc_style.specular.g(), ifc_style.specular.b())
-            styles[index] = Style(diffuse, specular,
-                                  1 if not ifc_style.has_transparency() else 1 - ifc_style.transparency)
-        return styles
+        # A colour's components are read as one tuple rather than with a call per channel
+        return {index: Style(Color(*ifc_style.diffuse.components), Color(*ifc_style.specular.components),
+                             1 if not ifc_style.has_transparency() else 1 - ifc_style.transparency)
+                for index, ifc_style in enumerate(ifc_styles)}
 
 
 class E57Reader:
@@ -120,6 +163,7 @@ class E57Reader:
         self._pointcloud: PointCloud | None = None
 
     def summary(self) -> None:
+        from rich import print
         print(f'Point cloud file {self._e57_file}')
         print(f'Number of points: {len(self.pointcloud.points)}')
 
@@ -4,9 +4,13 @@
 # it under the terms of the GNU General Public License as published by
 # the Free Software Foundation, either version 3 of the License, or
 # (at your option) any later version.
+import sys
+from collections import defaultdict
 from dataclasses import dataclass
 
+import numpy as np
 import vtk
+from vtk.util.numpy_support import numpy_to_vtk
 from vtkmodules.vtkCommonColor import vtkNamedColors
 from vtkmodules.vtkRenderingCore import (
     vtkRenderer,
@@ -14,9 +18,12 @@ from vtkmodules.vtkRenderingCore import (
     vtkRenderWindowInteractor,
 )
 
-from typing import Tuple, List
+from typing import Dict, Sequence, Set, Tuple, List
 
 _USE_SAMPLE_DATA: bool = False
+# Cell counts of a polydata in the order vtkAppendPolyData lays out the cell types
+_CELL_COUNTS_BY_TYPE = (vtk.vtkPolyData.GetNumberOfVerts, vtk.vtkPolyData.GetNumberOfLines,
+                        vtk.vtkPolyData.GetNumberOfPolys, vtk.vtkPolyData.GetNumberOfStrips)
 
 
 @dataclass(slots=True, frozen=True)
@@ -41,6 +48,10 @@ class Renderer:
     def meshes(self):
         return self._meshes
 
+    def add_mesh(self, mesh: MeshRep) -> None:
+        self._meshes.append(mesh)
+        self._visible_meshes = None
+
     @property
     def others(self):
         return self._others
@@ -54,9 +65,27 @@ class Renderer:
         self._pointcloud = pointcloud
 
     @property
-    def filter(self) -> List[str]:
+    def filter(self) -> Tuple[str, ...]:
         return self._filter
 
+    @filter.setter
+    def filter(self, categories: Sequence[str]):
+        self._filter = tuple(sys.intern(category) for category in categories)
+        self._filter_set = set(self._filter)
+        self._visible_meshes = None
+
+    @property
+    def visible_meshes(self) -> List[int]:
+        """
+        Indices of the meshes that pass the category filter. Worked out again when the filter changes
+        or meshes have been added, including ones appended to @:type meshes directly
+        """
+        if self._visible_meshes is None or self._num_meshes_filtered != len(self._meshes):
+            self._visible_meshes = \
+                [index for index, mesh in enumerate(self._meshes) if not self._is_filtered_out(mesh)]
+            self._num_meshes_filtered = len(self._meshes)
+        return self._visible_meshes
+
     def __init__(self, size: Tuple[int, int] = (1024, 768)):
         self._SIZE: Tuple[int, int] = size
 
@@ -71,7 +100,10 @@ class Renderer:
         self._renderer.UseDepthPeelingOn()
         self._ren_win.AddRenderer(self._renderer)
         self._meshes: List[MeshRep] = []
-        self._filter: List[str] = []
+        self._filter: Tuple[str, ...] = ()
+        self._filter_set: Set[str] = set()
+        self._visible_meshes: List[int] | None = None
+        self._num_meshes_filtered: int = 0
         self._pointcloud: vtk.vtkPolyData | None = None
         self._others: List[vtk.vtkPolyData] = []
 
@@ -86,24 +118,50 @@ class Renderer:
         self._renderer.AddActor(sphere_actor)
 
     def _is_filtered_out(self, mesh: MeshRep) -> bool:
-        return self._filter and mesh.category not in self._filter
+        return bool(self._filter_set) and mesh.category not in self._filter_set
 
     def _add_meshes(self):
-        for mesh in (mesh for mesh in self.meshes if not self._is_filtered_out(mesh)):
-            lut = mesh.style[0]
-            prop = mesh.style[1]
+        # Meshes that share a lookup table and property are appended into one polydata, so each bucket
+        # is drawn by a single mapper and actor. The cells keep the index of the mesh they came from
+        buckets: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+        for index in self.visible_meshes:
+            mesh = self._meshes[index]
+            if mesh.polydata is not None:
+                buckets[(id(mesh.style[0]), id(mesh.style[1]))].append(index)
+        for indices in buckets.values():
+            lut, prop = self._meshes[indices[0]].style
             mesh_mapper = vtk.vtkPolyDataMapper()
-            mesh_mapper.SetInputData(mesh.polydata)
+            mesh_mapper.SetInputData(self._append([self._meshes[index].polydata for index in indices], indices))
             if lut:
                 mesh_mapper.SetLookupTable(lut)
                 mesh_mapper.SetScalarModeToUseCellData()
             else:
                 mesh_mapper.ScalarVisibilityOff()
+            # Styles share their property across meshes and readers, so each actor gets its own copy
+            # and changing one actor's look leaves every other mesh with that style alone
+            mesh_prop = vtk.vtkProperty()
+            mesh_prop.DeepCopy(prop)
             mesh_actor = vtk.vtkActor()
-            mesh_actor.SetProperty(prop)
+            mesh_actor.SetProperty(mesh_prop)
             mesh_actor.SetMapper(mesh_mapper)
             self._renderer.AddActor(mesh_actor)
 
+    @staticmethod
+    def _append(polydatas: List[vtk.vtkPolyData], mesh_ids: List[int]) -> vtk.vtkPolyData:
+        append = vtk.vtkAppendPolyData()
+        for polydata in polydatas:
+            append.AddInputData(polydata)
+        append.Update()
+        merged: vtk.vtkPolyData = append.GetOutput()
+        # The appended cells are ordered by type (verts, lines, polys, strips) and by input within each type
+        ids: np.ndarray = np.asarray(mesh_ids, dtype=np.int32)
+        cell_mesh_ids = numpy_to_vtk(np.concatenate(
+            [np.repeat(ids, [count(polydata) for polydata in polydatas]) for count in _CELL_COUNTS_BY_TYPE]),
+            deep=0, array_type=vtk.VTK_INT)
+        cell_mesh_ids.SetName('Mesh Id')
+        merged.GetCellData().AddArray(cell_mesh_ids)
+        return merged
+
     def _add_pointcloud(self):
         if self._pointcloud:
             pointcloud_mapper = vtk.vtkPolyDataMapper()
@@ -119,13 +177,15 @@ class Renderer:
 
     def _add_others(self):
         if self._others:
+            prop = vtk.vtkProperty()
+            prop.SetLineWidth(2.0)
+            prop.SetColor(self._colors.GetColor3d('DarkKhaki'))
             for other in self._others:
                 mapper = vtk.vtkPolyDataMapper()
                 mapper.SetInputData(other)
                 actor = vtk.vtkActor()
                 actor.SetMapper(mapper)
-                actor.GetProperty().SetLineWidth(2.0)
-                actor.GetProperty().SetColor(self._colors.GetColor3d('DarkKhaki'))
+                actor.SetProperty(prop)
                 self._renderer.AddActor(actor)
 
     def render(self):
@@ -9,8 +9,6 @@ from argparse import ArgumentParser
 from typing import Tuple
 
 import math3d
-from segmentation.reader import E57Reader, IFCReader
-from segmentation.renderer import Renderer, MeshRep
 
 
 def _setup_args() -> ArgumentParser:
@@ -37,14 +35,19 @@ def _parse_args(parser: ArgumentParser) -> Tuple[str, str, math3d.Matrix4]:
 def main():
     parser = _setup_args()
     ifc_ref, e57_pc, pc_transform = _parse_args(parser)
+    # The readers and the renderer pull in vtk, ifcopenshell and pye57, so they are only imported
+    # once the arguments are known to be valid and not just a request for help
+    from segmentation.reader import E57Reader, IFCReader
+    from segmentation.renderer import Renderer, MeshRep
     print(f'Segmenting point cloud {e57_pc} using {ifc_ref}')
     print(f'Point cloud to reference model transform\n{pc_transform}')
     pc_reader = E57Reader(e57_pc)
     ifc_reader = IFCReader(ifc_ref)
+    renderer = Renderer()
+    # Meshes are added to the renderer as the reader yields them, nothing is drawn until render()
+    for mesh in ifc_reader.iter_meshes():
+        renderer.add_mesh(MeshRep(mesh.polydata, mesh.category, mesh.get_lut_and_prop()))
     ifc_reader.summary()
     pc_reader.summary()
-    renderer = Renderer()
-    for mesh in ifc_reader.meshes:
-        renderer.meshes.append(MeshRep(mesh.polydata, mesh.category, mesh.get_lut_and_prop()))
     renderer.pointcloud = pc_reader.pointcloud.polydata
     renderer.render()
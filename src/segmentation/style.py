@@ -5,12 +5,31 @@
 # the Free Software Foundation, either version 3 of the License, or
 # (at your option) any later version.
 
-from dataclasses import dataclass
-from typing import List, Tuple, Dict
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple, Dict
+from weakref import WeakValueDictionary
 
+import numpy as np
 from vtkmodules.vtkRenderingCore import vtkProperty
 
 
+def _to_byte(value: float) -> int:
+    return int(round(value * 255))
+
+
+def rle_groups(ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Run-length encodes an array of ids in one pass. Returns the id of every run of equal ids along
+    with the inclusive start and end index of the run
+    """
+    ids = np.asarray(ids)
+    if not len(ids):
+        return ids[:0], np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    ends: np.ndarray = np.append(np.flatnonzero(ids[1:] != ids[:-1]), len(ids) - 1)
+    starts: np.ndarray = np.concatenate(([0], ends[:-1] + 1))
+    return ids[starts], starts, ends
+
+
 @dataclass(slots=True, frozen=True)
 class Color:
     r: float
@@ -20,100 +39,146 @@ class Color:
     def __str__(self):
         return f'{self.r}, {self.g}, {self.b}'
 
+    @property
+    def key(self) -> int:
+        """
+        The color packed into a single 24-bit RGB8 integer
+        """
+        return (_to_byte(self.r) << 16) | (_to_byte(self.g) << 8) | _to_byte(self.b)
+
+
+# vtk properties of the styles in use, by style key. An entry goes away once nothing holds its property
+_properties_by_key: WeakValueDictionary[Tuple[int, int, int], vtkProperty] = WeakValueDictionary()
+
 
+@dataclass(slots=True, frozen=True)
 class Style:
     """
-    A material that maps to ifc open shell's material definition
+    A material that maps to ifc open shell's material definition. Styles are compared by their
+    colors and alpha at 8 bits per channel, the precision they are rendered with, and styles that
+    compare equal share a single vtk property. The shared property must not be modified, copy it first
     """
     _AMBIENT_INTENSITY = 0.15
     _DIFFUSE_INTENSITY = 0.85
     _AMBIENT_COLOR = Color(0.75, 0.75, 0.75)
 
-    def __init__(self, diffuse: Color, specular: Color, alpha: float):
-        self._diffuse = diffuse
-        self._specular = specular
-        self._alpha = alpha
+    diffuse: Color
+    specular: Color
+    alpha: float
+    _key: Tuple[int, int, int] = field(init=False, repr=False, compare=False)
 
-    @property
-    def diffuse(self):
-        return self._diffuse
+    def __post_init__(self):
+        # Styles are hashed once per assigned face run, so the key is packed once up front
+        object.__setattr__(self, '_key', (self.diffuse.key, self.specular.key, _to_byte(self.alpha)))
 
-    @property
-    def specular(self):
-        return self._specular
+    def __str__(self):
+        return f'Diffuse = {self.diffuse},\n\tSpecular = {self.specular},\n\tAlpha = {self.alpha}'
 
-    @property
-    def alpha(self):
-        return self._alpha
+    def __eq__(self, other):
+        if not isinstance(other, Style):
+            return NotImplemented
+        return self._key == other._key
 
-    def __str__(self):
-        return f'Diffuse = {self._diffuse},\n\tSpecular = {self._specular},\n\tAlpha = {self._alpha}'
+    def __hash__(self):
+        return hash(self._key)
+
+    @property
+    def key(self) -> Tuple[int, int, int]:
+        return self._key
 
     @property
-    def style(self):
-        prop = vtkProperty()
-        prop.SetDiffuseColor(self.diffuse.r, self.diffuse.g, self.diffuse.b)
-        prop.SetSpecularColor(self.specular.r, self.specular.g, self.specular.b)
-        prop.SetOpacity(self.alpha)
-        prop.SetAmbient(Style._AMBIENT_INTENSITY)
-        prop.SetDiffuse(Style._DIFFUSE_INTENSITY)
-        prop.SetAmbientColor(Style._AMBIENT_COLOR.r, Style._AMBIENT_COLOR.g, Style._AMBIENT_COLOR.b)
+    def style(self) -> vtkProperty:
+        key = self.key
+        prop = _properties_by_key.get(key)
+        if prop is None:
+            prop = vtkProperty()
+            prop.SetDiffuseColor(self.diffuse.r, self.diffuse.g, self.diffuse.b)
+            prop.SetSpecularColor(self.specular.r, self.specular.g, self.specular.b)
+            prop.SetOpacity(self.alpha)
+            prop.SetAmbient(Style._AMBIENT_INTENSITY)
+            prop.SetDiffuse(Style._DIFFUSE_INTENSITY)
+            prop.SetAmbientColor(Style._AMBIENT_COLOR.r, Style._AMBIENT_COLOR.g, Style._AMBIENT_COLOR.b)
+            _properties_by_key[key] = prop
         return prop
 
 
 class Styles:
     """
-    Maintains a list of style assignments originally in the form of 1 to N triangle indices
-    Once all style assignments are complete, and request to assemble the styles is made, it
-    compresses the triangle indices into a sequence of contiguous ranges
+    Maintains the style assignments of a mesh's triangles as a table of unique styles and the
+    index into that table of every triangle. Contiguous ranges of triangles that share a style
+    are computed from the latter when requested
     """
 
-    def __init__(self):
-        self._styles: Dict[Style, List[Tuple[int, int]]] = {}
-        self._assignments: Dict[Style, List[int]] = {}
+    _UNASSIGNED: int = -1
+
+    def __init__(self, num_faces: int = 0):
+        self._style_table: List[Style] = []
+        self._style_ids: Dict[Style, int] = {}
+        # Grows geometrically, only the first _num_faces entries are faces of the mesh
+        self._face_style_id: np.ndarray = np.full(num_faces, Styles._UNASSIGNED, dtype=np.int32)
+        self._num_faces: int = num_faces
+        # Run-length encoding of the face style ids, dropped whenever an assignment changes them
+        self._runs: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None
 
     @property
     def list(self) -> List[Style]:
-        if not self._styles:
-            self._assemble()
-        return list(self._styles.keys())
+        return list(self._style_table)
 
     def __str__(self):
-        if not self._styles:
-            self._assemble()
         s = '\n'
-        for style, face_ids in self._styles.items():
+        for style in self._style_table:
             s += f'\t{style}\n'
-            for start, end in face_ids:
+            for start, end in self.get_faces(style):
                 s += f'\tAssigned to faces: [{start},{end}]\n'
         return s
 
     def get_faces(self, style: Style) -> List[Tuple[int, int]]:
-        if not self._styles:
-            self._assemble()
-        return self._styles[style]
-
-    def add(self, style: Style) -> None:
-        self._assignments[style] = []
+        starts, ends = self.get_face_ranges(style)
+        return list(zip(starts.tolist(), ends.tolist()))
+
+    def get_face_ranges(self, style: Style) -> Tuple[np.ndarray, np.ndarray]:
+        if self._runs is None:
+            self._runs = rle_groups(self._face_style_id[:self._num_faces])
+        style_ids, starts, ends = self._runs
+        of_style: np.ndarray = style_ids == self._style_ids[style]
+        return starts[of_style], ends[of_style]
+
+    def as_cell_scalars(self, num_faces: int) -> np.ndarray:
+        """
+        Returns a new array with the style index of each of the given number of faces, ready to be
+        used as cell scalars. Faces without a style get the first style
+        """
+        scalars: np.ndarray = np.zeros(num_faces, dtype=np.int32)
+        assigned: np.ndarray = self._face_style_id[:min(num_faces, self._num_faces)]
+        scalars[:len(assigned)] = np.maximum(assigned, 0)
+        return scalars
+
+    def add(self, style: Style) -> int:
+        """
+        Adds a style to the table if an equal one is not already in it and returns its index
+        """
+        index: Optional[int] = self._style_ids.get(style)
+        if index is None:
+            index = self._style_ids[style] = len(self._style_table)
+            self._style_table.append(style)
+        return index
 
     def assign(self, style: Style, face_id: int) -> None:
-        self._assignments.setdefault(style, []).append(face_id)
-
-    def _assemble(self):
-        self._styles.clear()
-        for style, face_ids in self._assignments.items():
-            self._styles[style] = Styles._make_ranges(face_ids)
-        self._assignments.clear()
-
-    @staticmethod
-    def _make_ranges(face_ids: List[int]) -> List[Tuple[int, int]]:
-        ranges = []
-        start = 0
-        for index, _ in enumerate(face_ids):
-            if index == 0:
-                continue
-            if face_ids[index] != face_ids[index - 1] + 1:
-                ranges.append((face_ids[start], face_ids[index - 1]))
-                start = index
-        ranges.append((face_ids[start], face_ids[-1]))
-        return ranges
+        self._reserve(face_id + 1)
+        self._face_style_id[face_id] = self.add(style)
+
+    def assign_range(self, style: Style, start: int, end: int) -> None:
+        """
+        Assigns a style to the inclusive range of face ids [start, end]
+        """
+        self._reserve(end + 1)
+        self._face_style_id[start:end + 1] = self.add(style)
+
+    def _reserve(self, num_faces: int) -> None:
+        # Called before every assignment, so it also drops the cached runs
+        self._runs = None
+        if num_faces > len(self._face_style_id):
+            grown = np.full(max(num_faces, 2 * len(self._face_style_id)), Styles._UNASSIGNED, dtype=np.int32)
+            grown[:self._num_faces] = self._face_style_id[:self._num_faces]
+            self._face_style_id = grown
+        self._num_faces = max(self._num_faces, num_faces)
@@ -0,0 +1,28 @@
+# Copyright (c) 2026 Murali Dhanakoti
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+import math3d
+import numpy as np
+
+
+def as_array(matrix: math3d.Matrix4) -> np.ndarray:
+    """
+    Copies a math3d 4x4 matrix into a row-major float32 numpy array
+    """
+    return np.array([[matrix[row, col] for col in range(4)] for row in range(4)], dtype=np.float32)
+
+
+def apply_transform(matrix: math3d.Matrix4, points: np.ndarray) -> np.ndarray:
+    """
+    Transforms an (N, 3) array of points by a 4x4 matrix in one batched multiply and
+    returns the transformed points as a contiguous (N, 3) float32 array
+    """
+    # Only x, y and z of each transformed point are kept, so the matrix's bottom row is never applied
+    transform = as_array(matrix)
+    transformed = np.einsum('ij,nj->ni', transform[:3, :3], np.asarray(points, dtype=np.float32), optimize=True)
+    transformed += transform[:3, 3]
+    return np.ascontiguousarray(transformed)